@@ -1,14 +1,160 @@
+import logging
 import os
+import socket
+import stat
+import struct
+import threading
+from contextlib import contextmanager
 from pathlib import Path, PurePosixPath
+from typing import Callable, Iterator
 
 from ppadb.client import Client as AdbClient
+from ppadb.connection import Connection
 from ppadb.device import Device as AdbDevice
+from ppadb.protocol import Protocol
+
+SYNC_POOL_SIZE = 4
+TRACK_DEVICES_TIMEOUT = 5
+PULL_BUFFER_SIZE = 4 * 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+# LIST only reports 32 bit sizes, the v2 listing reports full stat fields
+LIST_V2 = "LIS2"
+DENT_V2_ID = "DNT2"
+DENT_V2 = struct.Struct("<4sIQQIIIIQqqqI")  # id, error, dev, ino, mode, nlink, uid, gid, size, atime, mtime, ctime, namelen
+# STA2 is the v2 STAT, which also follows links
+STAT_V2_ID = "STA2"
+STAT_V2 = struct.Struct("<4sIQQIIIIQqqq")  # id, error, dev, ino, mode, nlink, uid, gid, size, atime, mtime, ctime
+
+
+class PullError(Exception):
+    """Raised when the device refuses to send a file."""
+
+
+def recv_exact(sock: socket.socket, length: int) -> bytes:
+    """Receive exactly `length` bytes from a socket, raising if the connection closes first."""
+
+    data = bytearray()
+    while len(data) < length:
+        chunk = sock.recv(length - len(data))
+        if not chunk:
+            raise ConnectionError("ADB connection closed")
+        data += chunk
+
+    return bytes(data)
+
+
+def getprops_command(names: list[str]) -> str:
+    """Build a single shell command which prints each property on its own line."""
+
+    return "; ".join(f"getprop {name}" for name in names)
+
+
+def parse_getprops(names: list[str], output: str | None) -> dict[str, str]:
+    """Parse the output of `getprops_command` into a property dictionary, defaulting missing lines to empty."""
+
+    lines = (output or "").splitlines()
+    return {name: lines[i].strip() if i < len(lines) else "" for i, name in enumerate(names)}
+
+
+def format_friendly_name(manufacturer: str, model: str) -> str:
+    return f"{(manufacturer or 'unknown').title()} {model or 'unknown'}"
+
+
+def recv_into_exact(sock: socket.socket, view: memoryview) -> None:
+    """Fill `view` from a socket, raising if the connection closes first."""
+
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError("ADB connection closed")
+        view = view[received:]
+
+
+def encode_sync_request(sync_id: str, path: str) -> bytes:
+    encoded = path.encode("utf-8")
+    return sync_id.encode("utf-8") + struct.pack("<I", len(encoded)) + encoded
+
+
+def pull(conn: Connection, src: str, dst: Path, size: int | None = None, on_data: Callable[[int], None] | None = None) -> None:
+    """Pull a file over a sync connection, receiving straight into a reusable buffer and writing it in large blocks.
+
+    Args:
+        conn (Connection): A connection already in sync mode.
+        src (str): The path of the file on the device.
+        dst (Path): The host path to write the file to.
+        size (int, optional): The expected file size, used to size the receive buffer and preallocate the destination. Defaults to None.
+        on_data (Callable[[int], None], optional): Called with the length of each chunk received, may block to throttle the transfer. Defaults to None.
+
+    Raises:
+        PullError: If the device could not send the file.
+    """
+    sock = conn.socket
+    sock.sendall(encode_sync_request(Protocol.RECV, src))
+
+    header = bytearray(8)
+    header_view = memoryview(header)
+    # Most photos are far smaller than the buffer, so don't allocate (and zero) more than the file needs
+    buffer = bytearray(PULL_BUFFER_SIZE if size is None else min(size, PULL_BUFFER_SIZE))
+    view = memoryview(buffer)
+    buffered = 0
+    written = 0
+
+    with open(dst, "wb", buffering=0) as f:
+        # Reserve the space up front so the file isn't fragmented by many small extensions
+        if size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except OSError:
+                pass
+
+        def flush():
+            nonlocal buffered, written
+            block = view[:buffered]
+            while block:
+                block = block[f.write(block) :]
+            written += buffered
+            buffered = 0
+
+        while True:
+            recv_into_exact(sock, header_view)
+            sync_id = header[:4].decode("utf-8")
+            length = struct.unpack_from("<I", header, 4)[0]
+
+            if sync_id == Protocol.DATA:
+                if buffered + length > len(buffer):
+                    flush()
+                    if length > len(buffer):
+                        buffer = bytearray(length)
+                        view = memoryview(buffer)
+
+                recv_into_exact(sock, view[buffered : buffered + length])
+                buffered += length
+
+                if on_data is not None:
+                    on_data(length)
+            elif sync_id == Protocol.DONE:
+                flush()
+                break
+            elif sync_id == Protocol.FAIL:
+                raise PullError(recv_exact(sock, length).decode("utf-8"))
+            else:
+                raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+
+        # Drop any preallocated space beyond the data actually received
+        if size and size != written:
+            f.truncate(written)
 
 
 class Device:
-    def __init__(self, device: AdbDevice) -> None:
+    def __init__(self, device: AdbDevice, state: str | None = None) -> None:
         self.device = device
-        self._cached_friendly_name = None
+        self.state = state
+        self._cached_props: dict[str, str] = {}
+        self._cached_features: set[str] | None = None
+        self._sync_pool: list[Connection] = []
+        self._sync_pool_lock = threading.Lock()
 
     @property
     def serial(self) -> str:
@@ -16,6 +162,10 @@ class Device:
 
     @property
     def authorised(self) -> bool:
+        # Use the state pushed by `host:track-devices` when we have it
+        if self.state is not None:
+            return self.state == "device"
+
         try:
             return self.device.get_state() == "device"
         except:
@@ -25,27 +175,85 @@ class Device:
     def friendly_name(self) -> str:
         """Get a user friendly name for the connected device."""
 
-        if self._cached_friendly_name is None:
-            manufacturer = (self.device.shell("getprop ro.product.manufacturer") or "unknown").strip().title()
-            model = (self.device.shell("getprop ro.product.model") or "unknown").strip()
-            self._cached_friendly_name = f"{manufacturer} {model}"
+        return format_friendly_name(*self.getprops("ro.product.manufacturer", "ro.product.model"))
+
+    def getprops(self, *names: str) -> list[str]:
+        """Get system properties from the device, caching them for the lifetime of the device."""
+
+        missing = [name for name in names if name not in self._cached_props]
+        if missing:
+            # Fetch every missing property with a single shell
+            self._cached_props.update(parse_getprops(missing, self.device.shell(getprops_command(missing))))
+
+        return [self._cached_props[name] for name in names]
+
+    @property
+    def features(self) -> set[str]:
+        """Get the ADB features supported by both the device and the ADB server (e.g. "ls_v2")."""
+
+        if self._cached_features is None:
+            try:
+                with self.device.client.create_connection() as conn:
+                    conn.send(f"host-serial:{self.serial}:features")
+                    device_features = set(conn.receive().split(","))
+                self._cached_features = device_features & set(self.device.client.features())
+            except RuntimeError:
+                # Older servers can't report features, so fall back to the original protocol
+                self._cached_features = set()
 
-        return self._cached_friendly_name
+        return self._cached_features
 
     def shell(self, cmd: str) -> str | None:
         """Send a shell command to the device."""
 
         return self.device.shell(cmd)
 
+    @contextmanager
+    def sync_connection(self) -> Iterator[Connection]:
+        """Borrow a connection in sync mode from the pool, opening a new one if none are idle."""
+
+        with self._sync_pool_lock:
+            conn = self._sync_pool.pop() if self._sync_pool else None
+
+        if conn is None:
+            conn = self.device.sync()
+
+        try:
+            yield conn
+        except:
+            # The connection may be left mid-transfer so don't reuse it
+            conn.close()
+            raise
+
+        with self._sync_pool_lock:
+            if len(self._sync_pool) < SYNC_POOL_SIZE:
+                self._sync_pool.append(conn)
+                return
+
+        conn.close()
+
+    def close(self) -> None:
+        """Close all pooled connections to the device."""
+
+        with self._sync_pool_lock:
+            pool, self._sync_pool = self._sync_pool, []
+
+        for conn in pool:
+            conn.close()
+
     def __str__(self) -> str:
         return f"{self.device.serial} ({self.friendly_name})"
 
 
 class DevicePath:
-    def __init__(self, device: Device, path: str | PurePosixPath, is_dir: bool | None = None) -> None:
+    def __init__(
+        self, device: Device, path: str | PurePosixPath, is_dir: bool | None = None, size: int | None = None, mtime: int | None = None
+    ) -> None:
         self.device = device
         self._path = PurePosixPath(path)
         self._is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
 
     @property
     def name(self) -> str:
@@ -79,21 +287,72 @@ class DevicePath:
         if not self.is_dir:
             raise NotADirectoryError
 
-        # Redirect errors to null to avoid showing "No such file or output directory" as a file
-        dir_listing = (self.device.shell(f'ls "{self.path}/" -p -1 2>/dev/null') or "").splitlines()
-        return [DevicePath(self.device, self._path / item.replace("\\ ", " "), item.endswith("/")) for item in dir_listing]
-
-    def copy(self, dst: Path):
+        # Use a sync listing so each entry comes with its type, size and modification time
+        if "ls_v2" in self.device.features:
+            return self._list_v2()
+
+        return self._list_v1()
+
+    def _list_v2(self) -> "list[DevicePath]":
+        items: list[DevicePath] = []
+        with self.device.sync_connection() as conn:
+            conn.socket.sendall(encode_sync_request(LIST_V2, self.path))
+
+            while True:
+                sync_id, error, _, _, mode, _, _, _, size, _, mtime, _, name_length = DENT_V2.unpack(recv_exact(conn.socket, DENT_V2.size))
+                if sync_id.decode("utf-8") == Protocol.DONE:
+                    break
+                if sync_id.decode("utf-8") != DENT_V2_ID:
+                    raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+
+                name = recv_exact(conn.socket, name_length).decode("utf-8")
+                # Entries the device couldn't stat are reported with an error and no metadata
+                if name not in (".", "..") and not error:
+                    items.append(DevicePath(self.device, self._path / name, stat.S_ISDIR(mode), size, mtime))
+
+        return items
+
+    def _list_v1(self) -> "list[DevicePath]":
+        items: list[DevicePath] = []
+        with self.device.sync_connection() as conn:
+            conn.socket.sendall(encode_sync_request(Protocol.LIST, self.path))
+
+            while True:
+                sync_id, mode, size, mtime, name_length = struct.unpack("<4sIIII", recv_exact(conn.socket, 20))
+                if sync_id.decode("utf-8") == Protocol.DONE:
+                    break
+                if sync_id.decode("utf-8") != Protocol.DENT:
+                    raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+
+                name = recv_exact(conn.socket, name_length).decode("utf-8")
+                if name not in (".", ".."):
+                    items.append(DevicePath(self.device, self._path / name, stat.S_ISDIR(mode), size, mtime))
+
+        # LIST sizes are only 32 bit so files of 4 GiB or more wrap, ask the device for the real sizes instead
+        files = {item.name: item for item in items if not item.is_dir}
+        if files:
+            output = self.device.shell(f'stat -c "%s %n" "{self.path}/"* "{self.path}/".* 2>/dev/null') or ""
+            for line in output.splitlines():
+                size, _, name = line.partition(" ")
+                item = files.get(PurePosixPath(name).name)
+                if item is not None and size.isdigit():
+                    item.size = int(size)
+
+        return items
+
+    def copy(self, dst: Path, on_data: Callable[[int], None] | None = None):
         """Copy the file from the ADB device onto the host machine."""
 
-        self.device.device.pull(self.path, dst)
+        with self.device.sync_connection() as conn:
+            pull(conn, self.path, dst, self.size, on_data)
 
-    def copy2(self, dst: Path):
+    def copy2(self, dst: Path, on_data: Callable[[int], None] | None = None):
         """Copy the file from the ADB device onto the host machine whilst keeping timestamp metadata."""
 
-        mtime_str = (self.device.shell(f'stat -c %Y "{self.path}"') or "").strip()
-        mtime = int(mtime_str)
-        self.copy(dst)
+        mtime = self.mtime
+        if mtime is None:
+            mtime = int((self.device.shell(f'stat -c %Y "{self.path}"') or "").strip())
+        self.copy(dst, on_data)
         os.utime(dst, (mtime, mtime))
 
     def remove(self):
@@ -101,16 +360,16 @@ class DevicePath:
 
         self.device.shell(f'rm "{self.path}"')
 
-    def cut(self, dst: Path):
+    def cut(self, dst: Path, on_data: Callable[[int], None] | None = None):
         """Cut the file from the ADB device onto the host machine."""
 
-        self.copy(dst)
+        self.copy(dst, on_data)
         self.remove()
 
-    def cut2(self, dst: Path):
+    def cut2(self, dst: Path, on_data: Callable[[int], None] | None = None):
         """Cut the file from the ADB device onto the host machine whilst keeping timestamp metadata."""
 
-        self.copy2(dst)
+        self.copy2(dst, on_data)
         self.remove()
 
     def __truediv__(self, other: "DevicePath|PurePosixPath|str") -> "DevicePath":
@@ -133,6 +392,15 @@ class ADB:
 
         self.client.version
 
+        # Long-lived registry of devices keyed by serial, kept up to date by `host:track-devices`
+        self._devices: dict[str, Device] = {}
+        self._devices_lock = threading.Lock()
+        self._tracker: threading.Thread | None = None
+        self._tracker_conn: Connection | None = None
+        self._tracking = False
+        self._tracker_ready = threading.Event()
+        self._closed = False
+
     def is_alive(self):
         try:
             self.client.version()
@@ -140,12 +408,106 @@ class ADB:
         except:
             return False
 
+    def _ensure_tracking(self) -> None:
+        """Start tracking devices in the background if we are not already."""
+
+        tracker = self._tracker
+        if tracker is not None and tracker.is_alive() and not self._tracking:
+            # Let a dying tracker finish clearing the registry before starting a new one
+            tracker.join(TRACK_DEVICES_TIMEOUT)
+
+        with self._devices_lock:
+            if self._tracker is not None and self._tracker.is_alive():
+                return
+
+            self._closed = False
+            self._tracking = True
+            self._tracker_ready.clear()
+            self._tracker = threading.Thread(target=self._track_devices, daemon=True)
+            self._tracker.start()
+
+    def _track_devices(self) -> None:
+        """Receive pushed device lists from the ADB server until the connection is lost."""
+
+        conn = None
+        try:
+            conn = self.client.create_connection()
+            self._tracker_conn = conn
+            # `close` may have run before there was a connection for it to shut down
+            if self._closed:
+                return
+            conn.send("host:track-devices")
+
+            while True:
+                length = int(recv_exact(conn.socket, 4).decode("utf-8"), 16)
+                listing = recv_exact(conn.socket, length).decode("utf-8") if length else ""
+                self._update_devices(listing)
+                self._tracker_ready.set()
+        except (OSError, RuntimeError, ValueError):
+            # Closing the connection ourselves is the expected way for tracking to end
+            if not self._closed:
+                logger.exception("Lost track of ADB devices")
+        finally:
+            if conn is not None:
+                conn.close()
+            self._tracker_conn = None
+
+            # Devices can't be trusted without the tracker, so drop them along with their connections
+            self._update_devices("")
+            self._tracking = False
+            self._tracker_ready.set()
+
+    def _update_devices(self, listing: str) -> None:
+        """Update the device registry from a `host:devices` style listing."""
+
+        states: dict[str, str] = {}
+        for line in listing.splitlines():
+            tokens = line.split()
+            if len(tokens) > 1:
+                states[tokens[0]] = tokens[1]
+
+        removed: list[Device] = []
+        with self._devices_lock:
+            for serial in list(self._devices):
+                if serial not in states:
+                    removed.append(self._devices.pop(serial))
+
+            for serial, state in states.items():
+                device = self._devices.get(serial)
+                if device is None:
+                    self._devices[serial] = Device(AdbDevice(self.client, serial), state)
+                else:
+                    device.state = state
+
+        for device in removed:
+            device.close()
+
     def get_devices(self) -> list[Device]:
-        return [Device(adbDevice) for adbDevice in self.client.devices()]
+        # Retry once, as the previous tracker may have only just been lost and needs restarting
+        for _ in range(2):
+            self._ensure_tracking()
 
-    def get_device(self, serial: str) -> Device | None:
-        device = self.client.device(serial)
-        if device:
-            return Device(device)
+            if self._tracker_ready.wait(TRACK_DEVICES_TIMEOUT) and self._tracking:
+                with self._devices_lock:
+                    return list(self._devices.values())
 
-        return None
+        raise ConnectionError("Could not track ADB devices")
+
+    def get_device(self, serial: str) -> Device | None:
+        return next((device for device in self.get_devices() if device.serial == serial), None)
+
+    def close(self) -> None:
+        """Stop tracking devices and close all pooled connections."""
+
+        self._closed = True
+        conn = self._tracker_conn
+        if conn is not None:
+            # Closing the socket unblocks the tracker which then clears the registry
+            try:
+                conn.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+        if self._tracker is not None:
+            self._tracker.join(TRACK_DEVICES_TIMEOUT)
@@ -0,0 +1,452 @@
+import asyncio
+import os
+import stat
+import struct
+from contextlib import asynccontextmanager
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterator, BinaryIO
+
+from adb import (
+    DENT_V2,
+    DENT_V2_ID,
+    LIST_V2,
+    PULL_BUFFER_SIZE,
+    STAT_V2,
+    STAT_V2_ID,
+    encode_sync_request,
+    format_friendly_name,
+    getprops_command,
+    parse_getprops,
+)
+from ppadb.protocol import Protocol
+
+SYNC_POOL_SIZE = 4
+
+Stream = tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+def close_stream(stream: Stream) -> None:
+    """Close an ADB connection without waiting for it to drain."""
+
+    stream[1].close()
+
+
+async def check_status(reader: asyncio.StreamReader) -> None:
+    """Read an ADB status reply, raising if the server responded with FAIL."""
+
+    status = (await reader.readexactly(4)).decode("utf-8")
+    if status != Protocol.OKAY:
+        length = int(await reader.readexactly(4), 16)
+        error = (await reader.readexactly(length)).decode("utf-8")
+        raise RuntimeError(f"ERROR: {repr(status)} {error}")
+
+
+async def send_request(stream: Stream, request: str) -> None:
+    """Send a host or transport request and wait for it to be accepted."""
+
+    reader, writer = stream
+    writer.write(Protocol.encode_data(request))
+    await writer.drain()
+    await check_status(reader)
+
+
+async def read_sync_header(reader: asyncio.StreamReader) -> tuple[str, int]:
+    """Read a sync packet id and its little endian argument."""
+
+    header = await reader.readexactly(8)
+    return header[:4].decode("utf-8"), struct.unpack("<I", header[4:])[0]
+
+
+def write_all(f: BinaryIO, block: memoryview) -> None:
+    """Write a whole block to an unbuffered file, which may only accept part of it at a time."""
+
+    while block:
+        block = block[f.write(block) :]
+
+
+async def raise_sync_fail(reader: asyncio.StreamReader, length: int) -> None:
+    """Raise the error message of a sync FAIL packet."""
+
+    message = (await reader.readexactly(length)).decode("utf-8")
+    raise OSError(message)
+
+
+class AsyncDevice:
+    def __init__(self, adb: "AsyncADB", serial: str, state: str | None = None) -> None:
+        self.adb = adb
+        self._serial = serial
+        self.state = state
+        self._cached_props: dict[str, str] = {}
+        self._cached_features: set[str] | None = None
+        self._sync_pool: list[Stream] = []
+
+    @property
+    def serial(self) -> str:
+        return self._serial
+
+    @property
+    def authorised(self) -> bool:
+        return self.state == "device"
+
+    async def friendly_name(self) -> str:
+        """Get a user friendly name for the connected device."""
+
+        return format_friendly_name(*await self.getprops("ro.product.manufacturer", "ro.product.model"))
+
+    async def getprops(self, *names: str) -> list[str]:
+        """Get system properties from the device, caching them for the lifetime of the device."""
+
+        missing = [name for name in names if name not in self._cached_props]
+        if missing:
+            # Fetch every missing property with a single shell
+            self._cached_props.update(parse_getprops(missing, await self.shell(getprops_command(missing))))
+
+        return [self._cached_props[name] for name in names]
+
+    async def features(self) -> set[str]:
+        """Get the ADB features supported by both the device and the ADB server (e.g. "ls_v2")."""
+
+        if self._cached_features is None:
+            try:
+                device_features = set((await self.adb._host_command(f"host-serial:{self.serial}:features")).split(","))
+                self._cached_features = device_features & set((await self.adb._host_command("host:features")).split(","))
+            except RuntimeError:
+                # Older servers can't report features, so fall back to the original protocol
+                self._cached_features = set()
+
+        return self._cached_features
+
+    async def _open_service(self, service: str) -> Stream:
+        """Open a connection to a service on the device."""
+
+        stream = await self.adb._connect()
+        try:
+            await send_request(stream, f"host:transport:{self.serial}")
+            await send_request(stream, service)
+        except:
+            close_stream(stream)
+            raise
+
+        return stream
+
+    async def shell(self, cmd: str) -> str:
+        """Send a shell command to the device."""
+
+        stream = await self._open_service(f"shell:{cmd}")
+        try:
+            return (await stream[0].read()).decode("utf-8")
+        finally:
+            close_stream(stream)
+
+    @asynccontextmanager
+    async def sync_connection(self) -> AsyncIterator[Stream]:
+        """Borrow a connection in sync mode from the pool, opening a new one if none are idle."""
+
+        stream = self._sync_pool.pop() if self._sync_pool else await self._open_service("sync:")
+
+        try:
+            yield stream
+        except:
+            # The connection may be left mid-transfer so don't reuse it
+            close_stream(stream)
+            raise
+
+        if len(self._sync_pool) < SYNC_POOL_SIZE:
+            self._sync_pool.append(stream)
+        else:
+            close_stream(stream)
+
+    def close(self) -> None:
+        """Close all pooled connections to the device."""
+
+        pool, self._sync_pool = self._sync_pool, []
+        for stream in pool:
+            close_stream(stream)
+
+    def __str__(self) -> str:
+        return f"{self.serial}"
+
+
+class AsyncDevicePath:
+    """Asynchronous counterpart of `adb.DevicePath`, where every device access is awaitable."""
+
+    def __init__(
+        self, device: AsyncDevice, path: str | PurePosixPath, mode: int | None = None, size: int | None = None, mtime: int | None = None
+    ) -> None:
+        self.device = device
+        self._path = PurePosixPath(path)
+        self._mode = mode
+        self.size = size
+        self.mtime = mtime
+
+    @property
+    def name(self) -> str:
+        return self._path.name
+
+    @property
+    def suffix(self) -> str:
+        return self._path.suffix
+
+    @property
+    def path(self) -> str:
+        return self._path.as_posix()
+
+    async def _request_stat(self, path: str) -> tuple[int, int, int]:
+        stat_v2 = "stat_v2" in await self.device.features()
+
+        async with self.device.sync_connection() as (reader, writer):
+            writer.write(encode_sync_request(STAT_V2_ID if stat_v2 else Protocol.STAT, path))
+            await writer.drain()
+
+            if stat_v2:
+                sync_id, error, _, _, mode, _, _, _, size, _, mtime, _ = STAT_V2.unpack(await reader.readexactly(STAT_V2.size))
+                if sync_id.decode("utf-8") != STAT_V2_ID:
+                    raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+                # Paths which can't be stat'd (e.g. don't exist) are reported with an error and no metadata
+                return (0, 0, 0) if error else (mode, size, mtime)
+
+            sync_id, mode = await read_sync_header(reader)
+            if sync_id != Protocol.STAT:
+                raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+            size, mtime = struct.unpack("<II", await reader.readexactly(8))
+
+        return mode, size, mtime
+
+    async def stat(self) -> tuple[int, int, int]:
+        """Get the mode, size and modification time of the path from the device, following links.
+
+        Also updates `size` and `mtime`, which are otherwise only known for paths returned by `list`.
+        """
+        mode, size, mtime = await self._request_stat(self.path)
+        if stat.S_ISLNK(mode):
+            # STAT doesn't follow links (e.g. "/sdcard"), a trailing slash resolves them
+            mode, size, mtime = await self._request_stat(f"{self.path}/")
+        elif stat.S_ISREG(mode) and "stat_v2" not in await self.device.features():
+            # STAT sizes are only 32 bit so files of 4 GiB or more wrap, ask the device for the real size instead
+            output = (await self.device.shell(f'stat -c %s "{self.path}"')).strip()
+            if output.isdigit():
+                size = int(output)
+
+        self._mode, self.size, self.mtime = mode, size, mtime
+        return mode, size, mtime
+
+    async def exists(self) -> bool:
+        if self._mode is None:
+            await self.stat()
+
+        # The sync protocol reports a mode of 0 for paths which don't exist
+        return self._mode != 0
+
+    async def is_dir(self) -> bool:
+        """Returns if the the given path is a directory."""
+
+        if self._mode is None or stat.S_ISLNK(self._mode):
+            await self.stat()
+
+        return stat.S_ISDIR(self._mode or 0)
+
+    async def list(self) -> list["AsyncDevicePath"]:
+        """List the files and folders at the given path."""
+
+        if not await self.is_dir():
+            raise NotADirectoryError
+
+        if "ls_v2" in await self.device.features():
+            return await self._list_v2()
+
+        return await self._list_v1()
+
+    async def _list_v2(self) -> "list[AsyncDevicePath]":
+        items: list[AsyncDevicePath] = []
+        async with self.device.sync_connection() as (reader, writer):
+            writer.write(encode_sync_request(LIST_V2, self.path))
+            await writer.drain()
+
+            while True:
+                sync_id, error, _, _, mode, _, _, _, size, _, mtime, _, name_length = DENT_V2.unpack(await reader.readexactly(DENT_V2.size))
+                if sync_id.decode("utf-8") == Protocol.DONE:
+                    break
+                if sync_id.decode("utf-8") != DENT_V2_ID:
+                    raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+
+                name = (await reader.readexactly(name_length)).decode("utf-8")
+                # Entries the device couldn't stat are reported with an error and no metadata
+                if name not in (".", "..") and not error:
+                    items.append(AsyncDevicePath(self.device, self._path / name, mode, size, mtime))
+
+        return items
+
+    async def _list_v1(self) -> "list[AsyncDevicePath]":
+        items: list[AsyncDevicePath] = []
+        async with self.device.sync_connection() as (reader, writer):
+            writer.write(encode_sync_request(Protocol.LIST, self.path))
+            await writer.drain()
+
+            while True:
+                sync_id, mode = await read_sync_header(reader)
+                if sync_id == Protocol.DONE:
+                    # DONE carries the same (zeroed) fields as a DENT
+                    await reader.readexactly(12)
+                    break
+                if sync_id == Protocol.FAIL:
+                    await raise_sync_fail(reader, mode)
+                if sync_id != Protocol.DENT:
+                    raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+
+                size, mtime, name_length = struct.unpack("<III", await reader.readexactly(12))
+                name = (await reader.readexactly(name_length)).decode("utf-8")
+                if name not in (".", ".."):
+                    items.append(AsyncDevicePath(self.device, self._path / name, mode, size, mtime))
+
+        # LIST sizes are only 32 bit so files of 4 GiB or more wrap, ask the device for the real sizes instead
+        files = {item.name: item for item in items if stat.S_ISREG(item._mode or 0)}
+        if files:
+            output = await self.device.shell(f'stat -c "%s %n" "{self.path}/"* "{self.path}/".* 2>/dev/null')
+            for line in output.splitlines():
+                size, _, name = line.partition(" ")
+                item = files.get(PurePosixPath(name).name)
+                if item is not None and size.isdigit():
+                    item.size = int(size)
+
+        return items
+
+    async def copy(self, dst: Path):
+        """Copy the file from the ADB device onto the host machine.
+
+        Chunks are gathered into a buffer which is written in large blocks on a worker thread, so disk writes don't
+        stall the other transfers sharing the event loop.
+        """
+        buffer = bytearray(PULL_BUFFER_SIZE if self.size is None else min(self.size, PULL_BUFFER_SIZE))
+        view = memoryview(buffer)
+        buffered = 0
+
+        async with self.device.sync_connection() as (reader, writer):
+            writer.write(encode_sync_request(Protocol.RECV, self.path))
+            await writer.drain()
+
+            f = await asyncio.to_thread(open, dst, "wb", buffering=0)
+            try:
+                while True:
+                    sync_id, length = await read_sync_header(reader)
+                    if sync_id == Protocol.DATA:
+                        if buffered + length > len(buffer):
+                            await asyncio.to_thread(write_all, f, view[:buffered])
+                            buffered = 0
+                            if length > len(buffer):
+                                buffer = bytearray(length)
+                                view = memoryview(buffer)
+
+                        view[buffered : buffered + length] = await reader.readexactly(length)
+                        buffered += length
+                    elif sync_id == Protocol.DONE:
+                        await asyncio.to_thread(write_all, f, view[:buffered])
+                        break
+                    elif sync_id == Protocol.FAIL:
+                        await raise_sync_fail(reader, length)
+                    else:
+                        raise RuntimeError(f"Unexpected sync response {repr(sync_id)}")
+            finally:
+                await asyncio.to_thread(f.close)
+
+    async def copy2(self, dst: Path):
+        """Copy the file from the ADB device onto the host machine whilst keeping timestamp metadata."""
+
+        mtime = self.mtime
+        if mtime is None:
+            _, _, mtime = await self.stat()
+        await self.copy(dst)
+        os.utime(dst, (mtime, mtime))
+
+    async def remove(self):
+        """Remove the file from the ADB device."""
+
+        await self.device.shell(f'rm "{self.path}"')
+
+    async def cut(self, dst: Path):
+        """Cut the file from the ADB device onto the host machine."""
+
+        await self.copy(dst)
+        await self.remove()
+
+    async def cut2(self, dst: Path):
+        """Cut the file from the ADB device onto the host machine whilst keeping timestamp metadata."""
+
+        await self.copy2(dst)
+        await self.remove()
+
+    def __truediv__(self, other: "AsyncDevicePath|PurePosixPath|str") -> "AsyncDevicePath":
+
+        if isinstance(other, AsyncDevicePath):
+            if self.device.serial != other.device.serial:
+                raise ValueError("Must be the same device")
+
+        other_path = other.path if isinstance(other, AsyncDevicePath) else other
+
+        return AsyncDevicePath(self.device, self._path / other_path)
+
+    def __str__(self) -> str:
+        return f"{self.path} @ {self.device}"
+
+
+class AsyncADB:
+    """ADB client driven entirely by asyncio streams, so many shells and transfers can share one event loop."""
+
+    def __init__(self, host="127.0.0.1", port=5037) -> None:
+        self.host = host
+        self.port = port
+        self._devices: dict[str, AsyncDevice] = {}
+
+    async def _connect(self) -> Stream:
+        try:
+            return await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            raise RuntimeError(f"ERROR: connecting to {self.host}:{self.port} {e}.\nIs adb running on your computer?")
+
+    async def _host_command(self, cmd: str) -> str:
+        """Run a host command and return its length prefixed response."""
+
+        stream = await self._connect()
+        try:
+            await send_request(stream, cmd)
+            length = int(await stream[0].readexactly(4), 16)
+            return (await stream[0].readexactly(length)).decode("utf-8")
+        finally:
+            close_stream(stream)
+
+    async def version(self) -> int:
+        return int(await self._host_command("host:version"), 16)
+
+    async def is_alive(self) -> bool:
+        try:
+            await self.version()
+            return True
+        except:
+            return False
+
+    async def get_devices(self) -> list[AsyncDevice]:
+        states: dict[str, str] = {}
+        for line in (await self._host_command("host:devices")).splitlines():
+            tokens = line.split()
+            if len(tokens) > 1:
+                states[tokens[0]] = tokens[1]
+
+        # Keep device objects alive across calls so their caches and connections are reused
+        for serial in list(self._devices):
+            if serial not in states:
+                self._devices.pop(serial).close()
+
+        for serial, state in states.items():
+            device = self._devices.setdefault(serial, AsyncDevice(self, serial))
+            device.state = state
+
+        return list(self._devices.values())
+
+    async def get_device(self, serial: str) -> AsyncDevice | None:
+        return next((device for device in await self.get_devices() if device.serial == serial), None)
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+
+        for device in self._devices.values():
+            device.close()
+        self._devices = {}
@@ -1,16 +1,32 @@
 import os
+import queue
 import shutil
+import threading
+import time
 from pathlib import Path, PurePosixPath
-from typing import Generator
+from typing import Generator, NoReturn
 
-from adb import ADB, DevicePath
+from adb import ADB, Device, DevicePath, PullError
 from fastapi import HTTPException
+from pydantic import BaseModel
 from server import ADB_NO_CONNECTION
-from typings import BackupYield, LogEntry, UserConfig
+from typings import BackupPlanSummary, BackupYield, LogEntry, TransferOrder, UserConfig
 
 TEMP_FOLDER = "temp"
 ROOT_DIR = PurePosixPath("/sdcard")
 
+# Sizes and rates shown to the user (e.g. `UserConfig.bandwidthLimit`) are in decimal megabytes
+BYTES_PER_MB = 1000 * 1000
+
+# Rough ADB over USB throughput used to project how long a backup will take
+ESTIMATED_BYTES_PER_SECOND = 20 * 1024 * 1024
+ESTIMATED_SECONDS_PER_FILE = 0.02
+
+# Files at least this large are transferred on their own lane
+LARGE_FILE_SIZE = 64 * 1024 * 1024
+CAMERA_DIRS = [ROOT_DIR / "DCIM"]
+PROGRESS_INTERVAL = 0.5
+
 
 def move2(src: str, dest: str) -> None:
     """Move a file while preserving metadata.
@@ -44,15 +60,77 @@ def get_resolved_path(wanted_filename: Path) -> Path:
     return wanted_filename.parent / new_filename
 
 
-def scan_folder(
-    path: DevicePath, config: UserConfig, destination: Path, depth: int = 0, passed_progress: float = 0, progress_multiplier: float = 1
-) -> Generator[BackupYield, None, None]:
-    """Recursively scan a folder and copy/move files based on the configuration given.
+class BackupPlan(BaseModel):
+    files: list[DevicePath] = []
+    skipped_files: int = 0
+    skipped_bytes: int = 0
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(item.size or 0 for item in self.files)
+
+    def summary(self, bandwidth_limit: float | None = None) -> BackupPlanSummary:
+        """Summarise the plan, projecting the transfer time at the given bandwidth limit in MB/s."""
+
+        total_bytes = self.total_bytes
+        bytes_per_second = ESTIMATED_BYTES_PER_SECOND
+        if bandwidth_limit is not None:
+            bytes_per_second = min(bandwidth_limit * BYTES_PER_MB, bytes_per_second)
+        return BackupPlanSummary(
+            totalFiles=len(self.files) + self.skipped_files,
+            totalBytes=total_bytes + self.skipped_bytes,
+            newFiles=len(self.files),
+            newBytes=total_bytes,
+            skippedFiles=self.skipped_files,
+            skippedBytes=self.skipped_bytes,
+            projectedSeconds=total_bytes / bytes_per_second + len(self.files) * ESTIMATED_SECONDS_PER_FILE,
+        )
+
+
+def index_backed_up(destination: Path) -> set[tuple[str, int]]:
+    """Index the files already in the backup destination by name and size.
+
+    The whole destination is searched, as `file_tools.move` organises files by their EXIF time which can't be known
+    before the file is pulled.
+
+    Args:
+        destination (Path): The backup destination folder.
+
+    Returns:
+        set[tuple[str, int]]: The name and size of every file in the destination.
+    """
+    if not destination.is_dir():
+        return set()
+
+    return {(file_path.name, file_path.stat().st_size) for file_path in destination.rglob("*") if file_path.is_file()}
+
+
+def is_backed_up(item: DevicePath, backed_up: set[tuple[str, int]]) -> bool:
+    """Check whether a device file already exists in the backup destination.
+
+    Images which get their EXIF time set (or are converted to JPG) during a backup change size and possibly name, so
+    these are never detected and are always transferred again.
+
+    Args:
+        item (DevicePath): The device file.
+        backed_up (set[tuple[str, int]]): The index of files in the destination from `index_backed_up`.
+
+    Returns:
+        bool: True if a file with the same name and size has already been backed up.
+    """
+    return (item.name, item.size) in backed_up
+
+
+def plan_folder(path: DevicePath, config: UserConfig, backed_up: set[tuple[str, int]], plan: BackupPlan) -> Generator[BackupYield, None, None]:
+    """Recursively enumerate a folder and add the files to transfer to the plan, based on the configuration given.
 
     Args:
         path (DevicePath): The devices file path representing this folder.
-        config (ConfigManager): The configuration to use when scanning.
-        destination (str): The destination folder to place our copied/moved files into.
+        config (UserConfig): The configuration to use when scanning.
+        backed_up (set[tuple[str, int]]): Files already in the backup destination, which are skipped.
+        plan (BackupPlan): The plan to add files to.
     """
     # Skip if we should ignore this path
     if path._path in [PurePosixPath(ignored_path) for ignored_path in config.ignoredDirs]:
@@ -66,38 +144,185 @@ def scan_folder(
     # Skip if item starts with '.' and we should ignore these
     if config.skipDot:
         items = [item for item in items if not item.name.startswith(".")]
-    total_item_count = len(items)
 
-    for i, item in enumerate(items):
+    for item in items:
         if item.is_dir:
             # If item is a folder then recursively call this function to scan though all files.
-            yield from scan_folder(
-                item, config, destination, depth + 1, passed_progress + (i / total_item_count) * progress_multiplier, progress_multiplier * (1 / total_item_count)
-            )
+            yield from plan_folder(item, config, backed_up, plan)
         else:
             ext = item.suffix.lower()
             # Skip if we should not copy/move this type of file
             if ext not in config.fileTypes:
                 continue
 
-            # Ensure we have a unique filename
-            resolved_destination = get_resolved_path(destination / item.name)
-            item.cut2(resolved_destination) if config.moveFiles else item.copy2(resolved_destination)
+            if is_backed_up(item, backed_up):
+                plan.skipped_files += 1
+                plan.skipped_bytes += item.size or 0
+                continue
+
+            plan.files.append(item)
+
+
+def order_files(files: list[DevicePath], order: TransferOrder) -> list[DevicePath]:
+    """Order planned files according to a transfer ordering policy.
+
+    Args:
+        files (list[DevicePath]): The planned files, in listing order.
+        order (TransferOrder): The ordering policy to apply.
+
+    Returns:
+        list[DevicePath]: The files in the order they should be transferred.
+    """
+    if order == "smallFirst":
+        return sorted(files, key=lambda item: item.size or 0)
+    if order == "newestFirst":
+        return sorted(files, key=lambda item: item.mtime or 0, reverse=True)
+    if order == "cameraFirst":
+        # Stable sort so each group keeps its listing order
+        return sorted(files, key=lambda item: not any(item._path.is_relative_to(camera_dir) for camera_dir in CAMERA_DIRS))
+
+    return list(files)
+
+
+class BandwidthLimiter:
+    """Throttles transfers sharing the limiter to a combined rate, by delaying each chunk until its slot at that rate."""
+
+    def __init__(self, bytes_per_second: float) -> None:
+        self.bytes_per_second = bytes_per_second
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
 
-            if item.name != resolved_destination.name:
-                yield BackupYield(log=LogEntry(content=f"Renamed {item.name} to {resolved_destination.name}"))
+    def consume(self, length: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._next_slot = max(self._next_slot, now) + length / self.bytes_per_second
+            delay = self._next_slot - now
 
-        if depth < 2:
-            yield BackupYield(progress=(passed_progress + ((i + 1) / total_item_count) * progress_multiplier))
+        time.sleep(delay)
 
 
-def scan_device(location: Path, adb: ADB, config: UserConfig) -> Generator[BackupYield, None, None]:
-    """Scan an ADB device and copy/move its files based on the configuration given.
+class TransferCancelled(Exception):
+    """Raised from within a transfer to abandon it once the backup is stopping."""
+
+
+def transfer(plan: BackupPlan, config: UserConfig, location: Path) -> Generator[BackupYield, None, None]:
+    """Copy/move the planned files from the device, reporting progress by bytes transferred.
+
+    Large and small files are transferred on separate lanes so a large video doesn't hold up the photos behind it.
+
+    Args:
+        plan (BackupPlan): The plan of files to transfer.
+        config (UserConfig): The configuration to use when transferring.
+        location (Path): The folder to place our copied/moved files into.
+    """
+    files = order_files(plan.files, config.transferOrder)
+    lanes = [
+        [item for item in files if (item.size or 0) >= LARGE_FILE_SIZE],
+        [item for item in files if (item.size or 0) < LARGE_FILE_SIZE],
+    ]
+    lanes = [lane for lane in lanes if lane]
+
+    limiter = BandwidthLimiter(config.bandwidthLimit * BYTES_PER_MB) if config.bandwidthLimit else None
+    total_bytes = plan.total_bytes
+    total_file_count = len(files)
+
+    events: queue.Queue[BackupYield | BaseException | None] = queue.Queue()
+    stop = threading.Event()
+    resolve_lock = threading.Lock()
+    # Bytes from completed files and from the file currently in progress on each lane
+    completed_bytes = [0] * len(lanes)
+    current_bytes = [0] * len(lanes)
+    completed_files = [0] * len(lanes)
+
+    def run_lane(index: int, lane: list[DevicePath]):
+        def on_data(length: int):
+            # Abort mid-file once stopping, rather than holding up the generator until a large file completes
+            if stop.is_set():
+                raise TransferCancelled
+
+            current_bytes[index] += length
+            if limiter is not None:
+                limiter.consume(length)
+
+        try:
+            for item in lane:
+                if stop.is_set():
+                    break
+
+                # Ensure we have a unique filename, claiming it so the other lane can't resolve to it too
+                with resolve_lock:
+                    resolved_destination = get_resolved_path(location / item.name)
+                    resolved_destination.touch()
+
+                try:
+                    item.cut2(resolved_destination, on_data) if config.moveFiles else item.copy2(resolved_destination, on_data)
+                except TransferCancelled:
+                    # The pull was aborted, so its connection is discarded and only a partial file is left
+                    resolved_destination.unlink(missing_ok=True)
+                    break
+                except PullError as e:
+                    resolved_destination.unlink(missing_ok=True)
+                    events.put(BackupYield(log=LogEntry(content=f"Could not copy {item.name}: {e}", type="warning")))
+                else:
+                    if item.name != resolved_destination.name:
+                        events.put(BackupYield(log=LogEntry(content=f"Renamed {item.name} to {resolved_destination.name}")))
+
+                completed_bytes[index] += item.size or 0
+                current_bytes[index] = 0
+                completed_files[index] += 1
+        except BaseException as e:
+            events.put(e)
+        finally:
+            events.put(None)
+
+    def get_progress() -> float:
+        # Fall back to file count when there is nothing to weigh by (e.g. only empty files)
+        if total_bytes:
+            return min((sum(completed_bytes) + sum(current_bytes)) / total_bytes, 1)
+        return sum(completed_files) / total_file_count if total_file_count else 1
+
+    workers = [threading.Thread(target=run_lane, args=(i, lane), daemon=True) for i, lane in enumerate(lanes)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        running = len(workers)
+        next_progress = time.monotonic() + PROGRESS_INTERVAL
+        while running:
+            try:
+                event = events.get(timeout=max(next_progress - time.monotonic(), 0))
+            except queue.Empty:
+                pass
+            else:
+                if event is None:
+                    running -= 1
+                elif isinstance(event, BaseException):
+                    raise event
+                else:
+                    yield event
+
+            # Report progress at a steady interval however many events arrive
+            if time.monotonic() >= next_progress:
+                yield BackupYield(progress=get_progress())
+                next_progress = time.monotonic() + PROGRESS_INTERVAL
+
+        yield BackupYield(progress=get_progress())
+    finally:
+        # Cancel any transfers still in progress and wait for them to clean up, so nothing is written after we return
+        stop.set()
+        for worker in workers:
+            worker.join()
+
+
+def get_device(adb: ADB, config: UserConfig) -> Device:
+    """Get the ADB device selected in the configuration, ensuring it is authorised.
 
     Args:
-        location (Path): The destination folder to place our copied/moved files into.
         adb (ADB): The connected adb server.
-        config (UserConfig): The configuration to use when selecting ADB device and scanning.
+        config (UserConfig): The configuration containing the selected device.
+
+    Returns:
+        Device: The selected device.
     """
     if config.adbDevice is None:
         raise Exception("Device not selected")
@@ -113,12 +338,49 @@ def scan_device(location: Path, adb: ADB, config: UserConfig) -> Generator[Backu
     if not device.authorised:
         raise Exception("Device is not authorised for ADB")
 
+    return device
+
+
+def raise_disconnected(adb: ADB) -> NoReturn:
+    """Raise the appropriate error after losing contact with the device mid operation."""
+
+    if adb.is_alive():
+        # ! ppadb sometimes doesn't throw when it is pulling a file and the device disconnects leaving us hanging.
+        raise Exception("ADB device was disconnected")
+    else:
+        raise HTTPException(status_code=ADB_NO_CONNECTION, detail="Could not connect to ADB server")
+
+
+def plan_device(adb: ADB, config: UserConfig, plan: BackupPlan) -> Generator[BackupYield, None, None]:
+    """Enumerate an ADB device and plan which files to copy/move based on the configuration given, without transferring anything.
+
+    Args:
+        adb (ADB): The connected adb server.
+        config (UserConfig): The configuration to use when selecting ADB device and scanning.
+        plan (BackupPlan): The plan to fill.
+    """
+    device = get_device(adb, config)
+
+    # Moving must still take every file off the device, so only skip backed up files when copying
+    backed_up = set() if config.moveFiles else index_backed_up(Path(config.destinationPath))
+
     root = DevicePath(device, ROOT_DIR)
     try:
-        yield from scan_folder(root, config, location)
+        yield from plan_folder(root, config, backed_up, plan)
     except:
-        if adb.is_alive():
-            # ! ppadb sometimes doesn't throw when it is pulling a file and the device disconnects leaving us hanging.
-            raise Exception("ADB device was disconnected")
-        else:
-            raise HTTPException(status_code=ADB_NO_CONNECTION, detail="Could not connect to ADB server")
+        raise_disconnected(adb)
+
+
+def scan_device(location: Path, adb: ADB, config: UserConfig, plan: BackupPlan) -> Generator[BackupYield, None, None]:
+    """Copy/move the planned files from an ADB device.
+
+    Args:
+        location (Path): The destination folder to place our copied/moved files into.
+        adb (ADB): The connected adb server.
+        config (UserConfig): The configuration to use when transferring.
+        plan (BackupPlan): The plan from `plan_device` of files to transfer.
+    """
+    try:
+        yield from transfer(plan, config, location)
+    except:
+        raise_disconnected(adb)
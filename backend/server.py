@@ -53,6 +53,10 @@ def get_app_state(request: Request) -> AppState:
 
 @app.post("/connect")
 async def connect(host: str = Query("127.0.0.1", description="ADB server host"), port: int = Query(5037, description="ADB server port"), state: AppState = Depends(get_app_state)):
+    # Stop tracking devices on the previous server before replacing it
+    if state.adb is not None:
+        state.adb.close()
+
     state.adb = ADB(host, port)
 
     if not state.adb.is_alive():
@@ -91,6 +95,24 @@ async def backup_start(body: BackupData, state: AppState = Depends(get_app_state
     return {"jobId": id}
 
 
+# Not async, so FastAPI runs the device scan in its threadpool rather than blocking other requests
+@app.post("/backup/plan")
+def backup_plan(body: BackupData, state: AppState = Depends(get_app_state)):
+    if state.adb is None:
+        raise HTTPException(status_code=ADB_NOT_INITIALISED, detail="ADB is not initialised")
+
+    plan = scanner.BackupPlan()
+    try:
+        for _ in scanner.plan_device(state.adb, body.config, plan):
+            pass
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return plan.summary(body.config.bandwidthLimit)
+
+
 @app.get("/backup")
 async def backup(jobId: str = Query("", description="ID given from `/backup/start` containing configuration"), state: AppState = Depends(get_app_state)):
     def get_stage_progress_range(stage_weights: dict[str, float]) -> dict[str, tuple[float, float]]:
@@ -158,6 +180,7 @@ async def backup(jobId: str = Query("", description="ID given from `/backup/star
 
         progress_ranges = get_stage_progress_range(
             {
+                "plan": 0.05,
                 "scan": 0.5,
                 "exif": 0.225 if backup_data.config.setExif else 0,
                 "move": 0.225,
@@ -165,15 +188,33 @@ async def backup(jobId: str = Query("", description="ID given from `/backup/star
             }
         )
 
-        # Find and move/copy all photos from ADB device to working folder
-        yield format_yield(BackupYield(log=LogEntry(content="Scanning device..."), progress=0), progress_ranges["scan"])
+        # Find all photos on the ADB device which need backing up
+        yield format_yield(BackupYield(log=LogEntry(content="Scanning device..."), progress=0), progress_ranges["plan"])
+        plan = scanner.BackupPlan()
+        try:
+            for y in scanner.plan_device(adb, backup_data.config, plan):
+                yield format_yield(y, progress_ranges["plan"])
+        except Exception as e:
+            yield yield_error(e)
+            return
+        summary = plan.summary(backup_data.config.bandwidthLimit)
+        yield format_yield(
+            BackupYield(
+                log=LogEntry(content=f"Found {summary.newFiles} new files ({summary.newBytes / scanner.BYTES_PER_MB:.1f} MB), skipping {summary.skippedFiles} already backed up"),
+                progress=1,
+            ),
+            progress_ranges["plan"],
+        )
+
+        # Move/copy the planned photos from ADB device to working folder
+        yield format_yield(BackupYield(log=LogEntry(content="Transferring files..."), progress=0), progress_ranges["scan"])
         try:
-            for y in scanner.scan_device(folder_path, adb, backup_data.config):
+            for y in scanner.scan_device(folder_path, adb, backup_data.config, plan):
                 yield format_yield(y, progress_ranges["scan"])
         except Exception as e:
             yield yield_error(e)
             return
-        yield format_yield(BackupYield(log=LogEntry(content="Device scan completed"), progress=1), progress_ranges["scan"])
+        yield format_yield(BackupYield(log=LogEntry(content="Transfer completed"), progress=1), progress_ranges["scan"])
 
         # Modify photo time in EXIF if required
         if backup_data.config.setExif:
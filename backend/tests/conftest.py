@@ -0,0 +1,26 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other by name, as they do when run as `python server.py`
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fake_adb import FakeAdbServer  # noqa: E402
+
+
+@pytest.fixture
+def fake_adb():
+    """Start fake ADB servers for the test, stopping them all afterwards."""
+
+    servers: list[FakeAdbServer] = []
+
+    def start(**kwargs) -> FakeAdbServer:
+        server = FakeAdbServer(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.stop()
@@ -0,0 +1,275 @@
+"""A fake ADB server speaking enough of the host, shell and sync protocols to drive `adb` and `async_adb` without a device.
+
+Also used by `scripts/bench-pull.py`, so it must stay free of any test framework imports.
+"""
+
+import re
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+from pathlib import PurePosixPath
+
+from adb import DENT_V2, STAT_V2, recv_exact
+
+MTIME = 1700000000
+CHUNK_SIZE = 64 * 1024
+ENOENT = 2
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """Threaded fake ADB server serving an in memory file tree.
+
+    Files map a device path to their contents, or to just a size for files which are only ever listed (e.g. 4 GiB
+    videos). Folders are implied by the file paths, and links map a path onto another (e.g. "/sdcard").
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(
+        self,
+        files: dict[str, bytes | int] | None = None,
+        links: dict[str, str] | None = None,
+        devices: dict[str, str] | None = None,
+        features: str = "shell_v2",
+        props: dict[str, str] | None = None,
+    ) -> None:
+        super().__init__(("127.0.0.1", 0), FakeAdbHandler)
+        self.files = dict(files or {})
+        self.links = links or {}
+        self.devices = {"abc": "device"} if devices is None else dict(devices)
+        self.features = features
+        self.props = props or {}
+        self.mtime = MTIME
+        # Delay between sent chunks, so concurrent transfers overlap
+        self.chunk_delay = 0.0
+
+        self.shells: list[str] = []
+        self.sync_connections = 0
+        self.track_requests = 0
+        self.active_transfers = 0
+        self.peak_transfers = 0
+        self._lock = threading.Lock()
+        # Trackers are woken whenever the devices change, or to be dropped
+        self._devices_changed = threading.Condition()
+        self._devices_version = 0
+        self._trackers: set[socket.socket] = set()
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> "FakeAdbServer":
+        threading.Thread(target=self.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.drop_trackers()
+        self.shutdown()
+        self.server_close()
+
+    def listing(self) -> bytes:
+        return "".join(f"{serial}\t{state}\n" for serial, state in self.devices.items()).encode("utf-8")
+
+    def set_device(self, serial: str, state: str | None) -> None:
+        """Add, update or (with no state) remove a device, pushing the change to trackers."""
+
+        with self._devices_changed:
+            if state is None:
+                self.devices.pop(serial, None)
+            else:
+                self.devices[serial] = state
+            self._devices_version += 1
+            self._devices_changed.notify_all()
+
+    def drop_trackers(self) -> None:
+        """Close every `host:track-devices` connection, as if the ADB server was restarted."""
+
+        with self._devices_changed:
+            trackers, self._trackers = self._trackers, set()
+            self._devices_changed.notify_all()
+
+        for sock in trackers:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def dirs(self) -> set[str]:
+        return {*self.links.values()} | {str(parent) for path in [*self.files, *self.links] for parent in PurePosixPath(path).parents}
+
+    def resolve(self, path: str, follow: bool = True) -> str:
+        """Resolve links in a path, following the final component only if asked to or given a trailing slash."""
+
+        follow = follow or path.endswith("/")
+        path = path.rstrip("/") or "/"
+        for link, target in self.links.items():
+            if path.startswith(f"{link}/") or (follow and path == link):
+                path = target + path[len(link) :]
+        return path
+
+    def stat(self, path: str) -> tuple[int, int]:
+        """Get the mode and size of a resolved path, with a mode of 0 if it doesn't exist."""
+
+        if path in self.links:
+            return stat.S_IFLNK | 0o777, 0
+        if path in self.dirs():
+            return stat.S_IFDIR | 0o755, 0
+        if path in self.files:
+            content = self.files[path]
+            return stat.S_IFREG | 0o644, content if isinstance(content, int) else len(content)
+        return 0, 0
+
+    def children(self, path: str) -> list[str]:
+        names: list[str] = []
+        for entry in [*sorted(self.dirs()), *self.links, *self.files]:
+            entry_path = PurePosixPath(entry)
+            if entry != path and str(entry_path.parent) == path and entry_path.name not in names:
+                names.append(entry_path.name)
+        return names
+
+    def shell(self, cmd: str) -> bytes:
+        """Run the handful of shell commands the clients use."""
+
+        self.shells.append(cmd)
+
+        if cmd.startswith("getprop "):
+            return "".join(f"{self.props.get(name, '')}\n" for name in re.findall(r"getprop ([^\s;]+)", cmd)).encode("utf-8")
+
+        if match := re.fullmatch(r'stat -c "%s %n" "(.*)/"\* .*', cmd):
+            folder = self.resolve(match[1])
+            lines = [f"{self.stat(str(PurePosixPath(folder) / name))[1]} {match[1]}/{name}\n" for name in self.children(folder)]
+            return "".join(lines).encode("utf-8")
+
+        if match := re.fullmatch(r'stat -c %s "(.*)"', cmd):
+            mode, size = self.stat(self.resolve(match[1]))
+            return f"{size}\n".encode("utf-8") if mode else b""
+
+        if match := re.fullmatch(r'stat -c %F "(.*)/"', cmd):
+            return b"directory\n" if self.resolve(match[1]) in self.dirs() else b""
+
+        if match := re.fullmatch(r'rm "(.*)"', cmd):
+            self.files.pop(self.resolve(match[1]), None)
+
+        return b""
+
+
+class FakeAdbHandler(socketserver.BaseRequestHandler):
+    server: FakeAdbServer
+
+    def read_request(self) -> str:
+        return recv_exact(self.request, int(recv_exact(self.request, 4), 16)).decode("utf-8")
+
+    def okay(self, payload: bytes | None = None) -> None:
+        self.request.sendall(b"OKAY" + (b"" if payload is None else b"%04x" % len(payload) + payload))
+
+    def fail(self, message: str) -> None:
+        encoded = message.encode("utf-8")
+        self.request.sendall(b"FAIL" + b"%04x" % len(encoded) + encoded)
+
+    def handle(self) -> None:
+        server = self.server
+        try:
+            request = self.read_request()
+            if request == "host:version":
+                self.okay(b"0029")
+            elif request == "host:features" or re.fullmatch(r"host-serial:[^:]+:features", request):
+                self.okay(server.features.encode("utf-8"))
+            elif request == "host:devices":
+                self.okay(server.listing())
+            elif request == "host:track-devices":
+                self.okay()
+                self.track_devices()
+            elif request.startswith("host:transport:"):
+                if request[len("host:transport:") :] not in server.devices:
+                    self.fail("device not found")
+                    return
+
+                self.okay()
+                service = self.read_request()
+                self.okay()
+
+                if service.startswith("shell:"):
+                    self.request.sendall(server.shell(service[len("shell:") :]))
+                elif service == "sync:":
+                    with server._lock:
+                        server.sync_connections += 1
+                    self.handle_sync()
+            else:
+                self.fail("unknown host service")
+        except OSError:
+            # Pooled connections are closed by the client whenever it is done with them
+            pass
+
+    def track_devices(self) -> None:
+        server = self.server
+        with server._devices_changed:
+            server.track_requests += 1
+            server._trackers.add(self.request)
+
+        seen = None
+        while True:
+            with server._devices_changed:
+                server._devices_changed.wait_for(lambda: server._devices_version != seen or self.request not in server._trackers)
+                if self.request not in server._trackers:
+                    return
+                seen = server._devices_version
+                listing = server.listing()
+
+            self.request.sendall(b"%04x" % len(listing) + listing)
+
+    def handle_sync(self) -> None:
+        server = self.server
+        while True:
+            sync_id = recv_exact(self.request, 4).decode("utf-8")
+            length = struct.unpack("<I", recv_exact(self.request, 4))[0]
+            path = recv_exact(self.request, length).decode("utf-8")
+
+            if sync_id == "STAT":
+                # STAT is an lstat, so doesn't follow a final link
+                mode, size = server.stat(server.resolve(path, follow=False))
+                self.request.sendall(b"STAT" + struct.pack("<III", mode, size % 2**32, server.mtime))
+            elif sync_id == "STA2":
+                mode, size = server.stat(server.resolve(path))
+                self.request.sendall(STAT_V2.pack(b"STA2", 0 if mode else ENOENT, 0, 0, mode, 1, 0, 0, size, server.mtime, server.mtime, server.mtime))
+            elif sync_id in ("LIST", "LIS2"):
+                folder = server.resolve(path)
+                for name in server.children(folder):
+                    mode, size = server.stat(str(PurePosixPath(folder) / name))
+                    encoded = name.encode("utf-8")
+                    if sync_id == "LIST":
+                        header = b"DENT" + struct.pack("<IIII", mode, size % 2**32, server.mtime, len(encoded))
+                    else:
+                        header = DENT_V2.pack(b"DNT2", 0, 0, 0, mode, 1, 0, 0, size, server.mtime, server.mtime, server.mtime, len(encoded))
+                    self.request.sendall(header + encoded)
+                self.request.sendall(b"DONE" + bytes(16 if sync_id == "LIST" else DENT_V2.size - 4))
+            elif sync_id == "RECV":
+                content = server.files.get(server.resolve(path))
+                if not isinstance(content, bytes):
+                    message = b"No such file or directory"
+                    self.request.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                else:
+                    self.send_file(content)
+            else:
+                return
+
+    def send_file(self, content: bytes) -> None:
+        server = self.server
+        with server._lock:
+            server.active_transfers += 1
+            server.peak_transfers = max(server.peak_transfers, server.active_transfers)
+
+        try:
+            view = memoryview(content)
+            for i in range(0, len(content), CHUNK_SIZE):
+                chunk = view[i : i + CHUNK_SIZE]
+                self.request.sendall(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+                if server.chunk_delay:
+                    time.sleep(server.chunk_delay)
+            self.request.sendall(b"DONE" + bytes(4))
+        finally:
+            with server._lock:
+                server.active_transfers -= 1
@@ -0,0 +1,206 @@
+import logging
+import os
+import time
+from pathlib import Path
+
+import pytest
+from adb import ADB, Device, DevicePath, PullError
+from fake_adb import MTIME
+from ppadb.client import Client as AdbClient
+from ppadb.device import Device as AdbDevice
+
+GiB = 1024**3
+PROPS = {"ro.product.manufacturer": "google", "ro.product.model": "Pixel 7"}
+
+FILES: dict[str, bytes | int] = {"/sdcard/DCIM/big.mp4": 4 * GiB + 123, "/sdcard/DCIM/a.jpg": 1000}
+
+
+@pytest.fixture
+def make_device(fake_adb):
+    def make(files: dict[str, bytes | int], features: str = "shell_v2"):
+        server = fake_adb(files=files, features=features)
+        return Device(AdbDevice(AdbClient(port=server.port), "abc"), "device"), server
+
+    return make
+
+
+def wait_until(predicate, timeout: float = 2) -> None:
+    """Wait for the background tracker to catch up with a change on the server."""
+
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "Timed out waiting for the condition"
+        time.sleep(0.01)
+
+
+def test_getprops_single_cached_shell(fake_adb):
+    server = fake_adb(props=PROPS)
+    device = Device(AdbDevice(AdbClient(port=server.port), "abc"), "device")
+
+    assert device.friendly_name == "Google Pixel 7"
+    assert device.getprops("ro.product.model") == ["Pixel 7"]
+    assert server.shells == ["getprop ro.product.manufacturer; getprop ro.product.model"]
+
+
+def test_sync_pool_reuses_and_discards(fake_adb):
+    server = fake_adb()
+    device = Device(AdbDevice(AdbClient(port=server.port), "abc"), "device")
+
+    with device.sync_connection() as first:
+        pass
+    with device.sync_connection() as second:
+        pass
+    assert second is first
+    wait_until(lambda: server.sync_connections == 1)
+
+    # A connection which raised may be mid-transfer, so it must not go back into the pool
+    with pytest.raises(RuntimeError):
+        with device.sync_connection():
+            raise RuntimeError
+    assert device._sync_pool == []
+
+    with device.sync_connection() as third:
+        pass
+    assert third is not first
+    wait_until(lambda: server.sync_connections == 2)
+    device.close()
+
+
+def test_registry_tracks_devices(fake_adb):
+    server = fake_adb(props=PROPS)
+    adb = ADB(port=server.port)
+
+    devices = adb.get_devices()
+    assert [(device.serial, device.state) for device in devices] == [("abc", "device")]
+    abc = devices[0]
+    with abc.sync_connection():
+        pass
+
+    server.set_device("xyz", "unauthorized")
+    wait_until(lambda: len(adb.get_devices()) == 2)
+    # Devices are kept between calls so their caches and connections are reused
+    assert adb.get_device("abc") is abc
+    assert not adb.get_device("xyz").authorised  # type: ignore[union-attr]
+
+    server.set_device("abc", "offline")
+    wait_until(lambda: abc.state == "offline")
+    assert not abc.authorised
+    assert adb.get_device("abc") is abc
+
+    # Removed devices are dropped along with their pooled connections
+    assert abc._sync_pool
+    server.set_device("abc", None)
+    wait_until(lambda: adb.get_device("abc") is None)
+    assert abc._sync_pool == []
+
+    assert server.track_requests == 1
+    adb.close()
+
+
+def test_registry_restarts_tracking_after_connection_lost(fake_adb, caplog):
+    server = fake_adb()
+    adb = ADB(port=server.port)
+    device = adb.get_device("abc")
+    tracker = adb._tracker
+    assert device is not None and tracker is not None
+
+    with caplog.at_level(logging.ERROR, logger="adb"):
+        server.drop_trackers()
+        tracker.join(2)
+    assert not tracker.is_alive()
+    assert adb._devices == {}
+    assert "Lost track of ADB devices" in caplog.text
+
+    # The stale device isn't handed out again once tracking restarts
+    restarted = adb.get_device("abc")
+    assert restarted is not None and restarted is not device
+    assert server.track_requests == 2
+    adb.close()
+
+
+def test_close_stops_tracking(fake_adb, caplog):
+    server = fake_adb()
+    adb = ADB(port=server.port)
+    adb.get_devices()
+    tracker = adb._tracker
+    assert tracker is not None
+
+    with caplog.at_level(logging.ERROR, logger="adb"):
+        adb.close()
+    assert not tracker.is_alive()
+    assert adb._devices == {}
+    # Closing is expected, so isn't reported as losing track
+    assert caplog.text == ""
+
+
+def test_close_before_tracker_connects(fake_adb):
+    server = fake_adb()
+    adb = ADB(port=server.port)
+    connect = adb.client.create_connection
+
+    def connect_after_close(*args, **kwargs):
+        # Hold the tracker back until `close` has already looked for its connection
+        wait_until(lambda: adb._closed)
+        return connect(*args, **kwargs)
+
+    adb.client.create_connection = connect_after_close  # type: ignore[method-assign]
+    adb._ensure_tracking()
+    adb.close()
+
+    assert adb._tracker is not None and not adb._tracker.is_alive()
+    assert server.track_requests == 0
+
+
+def test_list_v2_reports_64_bit_sizes(make_device):
+    device, server = make_device({**FILES, "/sdcard/DCIM/Camera/b.jpg": b""}, features="shell_v2,ls_v2,stat_v2")
+
+    items = {item.name: item for item in DevicePath(device, "/sdcard/DCIM", True).list()}
+
+    assert items["Camera"].is_dir
+    assert items["big.mp4"].size == 4 * GiB + 123
+    assert items["a.jpg"].size == 1000
+    assert items["a.jpg"].mtime == MTIME
+    # Sizes are already accurate so no shell is needed
+    assert server.shells == []
+
+
+def test_list_v1_corrects_wrapped_sizes(make_device):
+    device, server = make_device(FILES)
+
+    items = {item.name: item for item in DevicePath(device, "/sdcard/DCIM", True).list()}
+
+    assert items["big.mp4"].size == 4 * GiB + 123
+    assert items["a.jpg"].size == 1000
+    assert len(server.shells) == 1
+
+
+def test_pull_trims_preallocation(make_device, tmp_path: Path):
+    data = os.urandom(5 * 1024 * 1024 + 17)
+    device, _ = make_device({"/sdcard/DCIM/a.jpg": data})
+
+    # A stale size larger than the file must not leave padding behind
+    DevicePath(device, "/sdcard/DCIM/a.jpg", False, len(data) + 4096, MTIME).copy2(tmp_path / "a.jpg")
+
+    assert (tmp_path / "a.jpg").read_bytes() == data
+    assert (tmp_path / "a.jpg").stat().st_mtime == MTIME
+
+
+def test_pull_grows_undersized_buffer(make_device, tmp_path: Path):
+    data = os.urandom(300 * 1024)
+    device, _ = make_device({"/sdcard/DCIM/a.jpg": data})
+
+    # The buffer is sized from the listed size, so a stale smaller size must still receive every chunk
+    DevicePath(device, "/sdcard/DCIM/a.jpg", False, 10, MTIME).copy(tmp_path / "a.jpg")
+
+    assert (tmp_path / "a.jpg").read_bytes() == data
+
+
+def test_pull_fail(make_device, tmp_path: Path):
+    device, _ = make_device(FILES)
+
+    with pytest.raises(PullError, match="No such file"):
+        DevicePath(device, "/sdcard/DCIM/missing.jpg", False, 10, MTIME).copy(tmp_path / "missing.jpg")
+
+    # A refused file doesn't break later pulls
+    with pytest.raises(PullError):
+        DevicePath(device, "/sdcard/DCIM/missing.jpg", False, 10, MTIME).copy(tmp_path / "missing.jpg")
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from pathlib import Path
+
+import pytest
+from async_adb import AsyncADB, AsyncDevicePath
+from fake_adb import CHUNK_SIZE
+
+GiB = 1024**3
+
+FILES = {
+    "/storage/emulated/0/DCIM/a.jpg": b"hello",
+    "/storage/emulated/0/DCIM/big.mp4": os.urandom(3 * CHUNK_SIZE + 123),
+    "/storage/emulated/0/DCIM/c.mp4": os.urandom(2 * CHUNK_SIZE),
+}
+LINKS = {"/sdcard": "/storage/emulated/0"}
+DEVICES = {"abc": "device", "xyz": "unauthorized"}
+PROPS = {"ro.product.manufacturer": "google", "ro.product.model": "Pixel 7"}
+
+
+@pytest.fixture
+def server(fake_adb):
+    return fake_adb(files=FILES, links=LINKS, devices=DEVICES, props=PROPS)
+
+
+def test_devices(server):
+    async def run():
+        adb = AsyncADB(port=server.port)
+        devices = await adb.get_devices()
+
+        assert [(device.serial, device.authorised) for device in devices] == [("abc", True), ("xyz", False)]
+        # Devices are kept between calls so their caches are reused
+        assert (await adb.get_device("abc")) is devices[0]
+        assert await adb.get_device("missing") is None
+        adb.close()
+
+    asyncio.run(run())
+
+
+def test_shell_and_cached_props(server):
+    async def run():
+        adb = AsyncADB(port=server.port)
+        device = await adb.get_device("abc")
+        assert device is not None
+
+        assert await device.friendly_name() == "Google Pixel 7"
+        assert await device.friendly_name() == "Google Pixel 7"
+        assert server.shells == ["getprop ro.product.manufacturer; getprop ro.product.model"]
+        adb.close()
+
+    asyncio.run(run())
+
+
+def test_stat_and_list(server):
+    async def run():
+        adb = AsyncADB(port=server.port)
+        device = await adb.get_device("abc")
+        assert device is not None
+
+        # The root path is a symlink, which must still be listable
+        root = AsyncDevicePath(device, "/sdcard")
+        assert await root.is_dir()
+        assert await root.exists()
+        assert not await (root / "missing").exists()
+
+        dcim = (await root.list())[0]
+        assert dcim.path == "/sdcard/DCIM"
+        assert await dcim.is_dir()
+
+        items = {item.name: item for item in await dcim.list()}
+        assert sorted(items) == ["a.jpg", "big.mp4", "c.mp4"]
+        assert items["big.mp4"].size == len(FILES["/storage/emulated/0/DCIM/big.mp4"])
+        assert items["a.jpg"].mtime == server.mtime
+        assert not await items["a.jpg"].is_dir()
+
+        with pytest.raises(NotADirectoryError):
+            await items["a.jpg"].list()
+        adb.close()
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("features", ["shell_v2", "shell_v2,ls_v2,stat_v2"])
+def test_64_bit_sizes(fake_adb, features: str):
+    server = fake_adb(files={"/storage/emulated/0/DCIM/huge.mp4": 4 * GiB + 123}, links=LINKS, features=features)
+
+    async def run():
+        adb = AsyncADB(port=server.port)
+        device = await adb.get_device("abc")
+        assert device is not None
+
+        # Both the listing and a direct stat must agree, whether the sizes come from v2 sync or a shell
+        (huge,) = await AsyncDevicePath(device, "/sdcard/DCIM").list()
+        assert huge.size == 4 * GiB + 123
+
+        path = AsyncDevicePath(device, "/sdcard/DCIM/huge.mp4")
+        assert path.size is None
+        _, size, mtime = await path.stat()
+        assert size == path.size == 4 * GiB + 123
+        assert mtime == path.mtime == server.mtime
+        assert await path.exists()
+        assert not await AsyncDevicePath(device, "/sdcard/DCIM/missing.mp4").exists()
+        assert bool(server.shells) == ("stat_v2" not in features)
+        adb.close()
+
+    asyncio.run(run())
+
+
+def test_concurrent_copies(server, tmp_path: Path):
+    # Pace the transfers so they overlap
+    server.chunk_delay = 0.005
+
+    async def run():
+        adb = AsyncADB(port=server.port)
+        device = await adb.get_device("abc")
+        assert device is not None
+
+        items = await AsyncDevicePath(device, "/sdcard/DCIM").list()
+        await asyncio.gather(*[item.copy2(tmp_path / item.name) for item in items])
+
+        for item in items:
+            dst = tmp_path / item.name
+            assert dst.read_bytes() == FILES[f"/storage/emulated/0/DCIM/{item.name}"]
+            assert dst.stat().st_mtime == server.mtime
+
+        assert server.peak_transfers > 1
+        adb.close()
+
+    asyncio.run(run())
+
+
+def test_copy_with_stale_size(server, tmp_path: Path):
+    async def run():
+        adb = AsyncADB(port=server.port)
+        device = await adb.get_device("abc")
+        assert device is not None
+
+        # The buffer is sized from the known size, so a stale smaller size must still receive every chunk
+        await AsyncDevicePath(device, "/sdcard/DCIM/big.mp4", size=10).copy(tmp_path / "big.mp4")
+        assert (tmp_path / "big.mp4").read_bytes() == FILES["/storage/emulated/0/DCIM/big.mp4"]
+        adb.close()
+
+    asyncio.run(run())
+
+
+def test_copy_fail(server, tmp_path: Path):
+    async def run():
+        adb = AsyncADB(port=server.port)
+        device = await adb.get_device("abc")
+        assert device is not None
+
+        with pytest.raises(OSError, match="No such file"):
+            await AsyncDevicePath(device, "/sdcard/DCIM/missing.jpg").copy(tmp_path / "missing.jpg")
+        adb.close()
+
+    asyncio.run(run())
@@ -0,0 +1,226 @@
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from adb import ADB, Device, DevicePath
+from pydantic import ValidationError
+from scanner import (
+    ESTIMATED_BYTES_PER_SECOND,
+    ESTIMATED_SECONDS_PER_FILE,
+    LARGE_FILE_SIZE,
+    BackupPlan,
+    BandwidthLimiter,
+    index_backed_up,
+    is_backed_up,
+    order_files,
+    plan_device,
+    transfer,
+)
+from ppadb.client import Client as AdbClient
+from ppadb.device import Device as AdbDevice
+from typings import UserConfig
+
+DEVICE_FILES: dict[str, bytes | int] = {
+    "/sdcard/DCIM/Camera/a.jpg": b"aaaa",
+    "/sdcard/DCIM/Camera/B.JPG": b"bb",
+    "/sdcard/DCIM/Camera/notes.txt": b"n",
+    "/sdcard/DCIM/.hidden.jpg": b"h",
+    "/sdcard/DCIM/.thumbnails/t.jpg": b"t",
+    "/sdcard/Android/data/x.jpg": b"x",
+    "/sdcard/Pictures/d.mp4": b"dddddd",
+}
+
+
+def test_backed_up_matches_name_and_size_in_any_bucket(tmp_path: Path):
+    # Files are organised by EXIF time, which may not match the month of the device modification time
+    (tmp_path / "2021" / "05May").mkdir(parents=True)
+    (tmp_path / "2021" / "05May" / "a.jpg").write_bytes(b"12345")
+    backed_up = index_backed_up(tmp_path)
+
+    assert is_backed_up(DevicePath(None, "/sdcard/DCIM/a.jpg", False, 5, 0), backed_up)  # type: ignore[arg-type]
+    assert not is_backed_up(DevicePath(None, "/sdcard/DCIM/a.jpg", False, 6, 0), backed_up)  # type: ignore[arg-type]
+    assert not is_backed_up(DevicePath(None, "/sdcard/DCIM/b.jpg", False, 5, 0), backed_up)  # type: ignore[arg-type]
+
+
+def test_missing_destination_has_nothing_backed_up(tmp_path: Path):
+    assert index_backed_up(tmp_path / "missing") == set()
+
+
+def test_bandwidth_limit_must_be_positive():
+    config = dict(destinationPath="", ignoredDirs=[], fileTypes=[], setExif=False, skipDot=True, moveFiles=False, removeTempFiles=True)
+
+    with pytest.raises(ValidationError):
+        UserConfig(**config, bandwidthLimit=-1)
+    with pytest.raises(ValidationError):
+        UserConfig(**config, bandwidthLimit=0)
+    assert UserConfig(**config, bandwidthLimit=2.5).bandwidthLimit == 2.5
+
+
+def plan_config(destination: Path, **kwargs) -> UserConfig:
+    config = dict(
+        adbDevice="abc",
+        destinationPath=str(destination),
+        ignoredDirs=["/sdcard/Android"],
+        fileTypes=[".jpg", ".mp4"],
+        setExif=False,
+        skipDot=True,
+        moveFiles=False,
+        removeTempFiles=True,
+    )
+    return UserConfig(**{**config, **kwargs})
+
+
+@pytest.fixture
+def plan_for(fake_adb, tmp_path: Path):
+    """Plan a backup of `DEVICE_FILES`, where "a.jpg" has already been backed up."""
+
+    server = fake_adb(files=DEVICE_FILES)
+    adb = ADB(port=server.port)
+    (tmp_path / "2023").mkdir()
+    (tmp_path / "2023" / "a.jpg").write_bytes(b"aaaa")
+
+    def plan(**kwargs) -> tuple[BackupPlan, list[str]]:
+        plan = BackupPlan()
+        logs = [y.log.content for y in plan_device(adb, plan_config(tmp_path, **kwargs), plan) if y.log is not None]
+        return plan, logs
+
+    yield plan
+    adb.close()
+
+
+def test_plan_filters_and_skips_backed_up(plan_for):
+    plan, logs = plan_for()
+
+    assert sorted(item.path for item in plan.files) == ["/sdcard/DCIM/Camera/B.JPG", "/sdcard/Pictures/d.mp4"]
+    assert (plan.skipped_files, plan.skipped_bytes) == (1, 4)
+    assert not any("Android" in log or ".thumbnails" in log for log in logs)
+
+    summary = plan.summary()
+    assert (summary.totalFiles, summary.totalBytes) == (3, 12)
+    assert (summary.newFiles, summary.newBytes) == (2, 8)
+    assert (summary.skippedFiles, summary.skippedBytes) == (1, 4)
+    assert summary.projectedSeconds == pytest.approx(8 / ESTIMATED_BYTES_PER_SECOND + 2 * ESTIMATED_SECONDS_PER_FILE)
+
+
+def test_plan_includes_dot_files_unless_skipped(plan_for):
+    plan, _ = plan_for(skipDot=False)
+
+    assert sorted(item.name for item in plan.files) == [".hidden.jpg", "B.JPG", "d.mp4", "t.jpg"]
+
+
+def test_plan_moving_skips_nothing(plan_for):
+    # Moving must take every file off the device, even those already in the destination
+    plan, _ = plan_for(moveFiles=True)
+
+    assert sorted(item.name for item in plan.files) == ["B.JPG", "a.jpg", "d.mp4"]
+    assert (plan.skipped_files, plan.skipped_bytes) == (0, 0)
+
+
+def test_summary_projects_at_bandwidth_limit():
+    plan = make_plan([DevicePath(None, "/sdcard/DCIM/a.mp4", False, 10_000_000, 0)])  # type: ignore[arg-type]
+
+    seconds = 10_000_000 / ESTIMATED_BYTES_PER_SECOND + ESTIMATED_SECONDS_PER_FILE
+    assert plan.summary().projectedSeconds == pytest.approx(seconds)
+    assert plan.summary(2).projectedSeconds == pytest.approx(5 + ESTIMATED_SECONDS_PER_FILE)
+    # A limit above the expected throughput doesn't make the projection any faster
+    assert plan.summary(1000).projectedSeconds == pytest.approx(seconds)
+
+
+# Listing order, with each file's size and modification time
+ORDER_FILES = [
+    ("/sdcard/Pictures/a.jpg", 300, 3),
+    ("/sdcard/DCIM/Camera/b.jpg", 100, 1),
+    ("/sdcard/Download/c.jpg", 200, 4),
+    ("/sdcard/DCIM/d.mp4", 400, 2),
+]
+
+
+@pytest.mark.parametrize(
+    "order, expected",
+    [
+        ("listing", ["a.jpg", "b.jpg", "c.jpg", "d.mp4"]),
+        ("smallFirst", ["b.jpg", "c.jpg", "a.jpg", "d.mp4"]),
+        ("newestFirst", ["c.jpg", "a.jpg", "d.mp4", "b.jpg"]),
+        # Camera folders come first, and each group keeps its listing order
+        ("cameraFirst", ["b.jpg", "d.mp4", "a.jpg", "c.jpg"]),
+    ],
+)
+def test_order_files(order, expected: list[str]):
+    files = [DevicePath(None, path, False, size, mtime) for path, size, mtime in ORDER_FILES]  # type: ignore[arg-type]
+
+    assert [item.name for item in order_files(files, order)] == expected
+
+
+def test_bandwidth_limiter_shares_rate_between_threads():
+    limiter = BandwidthLimiter(1_000_000)
+
+    def consume():
+        for _ in range(10):
+            limiter.consume(10_000)
+
+    threads = [threading.Thread(target=consume) for _ in range(2)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 200 kB at 1 MB/s combined, where limiting each thread separately would take half as long
+    assert 0.19 <= time.monotonic() - start < 0.35
+
+
+class FakeDevicePath(DevicePath):
+    """Device file whose transfer is simulated by a callable, instead of pulling from a device."""
+
+    def __init__(self, name: str, size: int, transfer) -> None:
+        super().__init__(None, f"/sdcard/DCIM/{name}", False, size, 0)  # type: ignore[arg-type]
+        self.transfer = transfer
+
+    def copy2(self, dst: Path, on_data=None):
+        self.transfer(dst)
+
+
+def make_plan(items: list[DevicePath]) -> BackupPlan:
+    return BackupPlan(files=items)
+
+
+def copy_config(**kwargs) -> UserConfig:
+    return UserConfig(destinationPath="", ignoredDirs=[], fileTypes=[], setExif=False, skipDot=True, moveFiles=False, removeTempFiles=True, **kwargs)
+
+
+def test_transfer_reports_progress_during_steady_events(tmp_path: Path):
+    def write(dst: Path):
+        time.sleep(0.01)
+        dst.write_bytes(b"1")
+
+    # Every file shares a name so each transfer logs a rename, keeping the event queue busy
+    plan = make_plan([FakeDevicePath("a.jpg", 1, write) for _ in range(150)])
+    yields = list(transfer(plan, copy_config(), tmp_path))
+
+    renames = [i for i, y in enumerate(yields) if y.log is not None]
+    progress_before_done = [i for i, y in enumerate(yields) if y.progress is not None and i < renames[-1]]
+    assert len(renames) == 149
+    assert len(progress_before_done) >= 2
+
+
+def test_transfer_cancels_other_lane_after_error(fake_adb, tmp_path: Path):
+    server = fake_adb(files={"/sdcard/DCIM/large.mp4": bytes(4 * 1024 * 1024)})
+    device = Device(AdbDevice(AdbClient(port=server.port), "abc"), "device")
+
+    def fail(dst: Path):
+        time.sleep(0.2)
+        raise RuntimeError("device lost")
+
+    # The large file has its own lane, and at 1 MB/s would still be transferring for seconds after the small file fails
+    large = DevicePath(device, "/sdcard/DCIM/large.mp4", False, LARGE_FILE_SIZE, 0)
+    plan = make_plan([large, FakeDevicePath("small.jpg", 1, fail)])
+
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match="device lost"):
+        list(transfer(plan, copy_config(bandwidthLimit=1), tmp_path))
+
+    assert time.monotonic() - start < 1
+    # The cancelled pull leaves nothing behind, and its connection is not reused
+    assert not (tmp_path / "large.mp4").exists()
+    assert device._sync_pool == []
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import pytest
+import scanner  # noqa: F401 Loaded before server, as the two import each other
+import server
+from adb import ADB
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(fake_adb):
+    device_server = fake_adb(files={"/sdcard/DCIM/a.jpg": b"aaaa", "/sdcard/DCIM/b.jpg": b"bb"})
+    state: server.AppState = server.app.state.data
+    state.adb = ADB(port=device_server.port)
+
+    yield TestClient(server.app)
+
+    state.adb.close()
+    state.adb = None
+
+
+def plan_request(destination: Path, **kwargs) -> dict:
+    config = dict(
+        adbDevice="abc",
+        destinationPath=str(destination),
+        ignoredDirs=[],
+        fileTypes=[".jpg"],
+        setExif=False,
+        skipDot=True,
+        moveFiles=False,
+        removeTempFiles=True,
+    )
+    return {"config": {**config, **kwargs}}
+
+
+def test_backup_plan(client: TestClient, tmp_path: Path):
+    (tmp_path / "a.jpg").write_bytes(b"aaaa")
+
+    response = client.post("/backup/plan", json=plan_request(tmp_path))
+
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["totalFiles"] == 2
+    assert summary["totalBytes"] == 6
+    assert (summary["newFiles"], summary["newBytes"]) == (1, 2)
+    assert (summary["skippedFiles"], summary["skippedBytes"]) == (1, 4)
+    assert summary["projectedSeconds"] > 0
+
+
+def test_backup_plan_unknown_device(client: TestClient, tmp_path: Path):
+    response = client.post("/backup/plan", json=plan_request(tmp_path, adbDevice="missing"))
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "ADB device not found"
+
+
+def test_backup_plan_without_adb(tmp_path: Path):
+    response = TestClient(server.app).post("/backup/plan", json=plan_request(tmp_path))
+
+    assert response.status_code == server.ADB_NOT_INITIALISED
@@ -1,6 +1,8 @@
 from typing import Literal
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+TransferOrder = Literal["listing", "smallFirst", "newestFirst", "cameraFirst"]
 
 
 class UserConfig(BaseModel):
@@ -12,6 +14,8 @@ class UserConfig(BaseModel):
     skipDot: bool
     moveFiles: bool
     removeTempFiles: bool
+    transferOrder: TransferOrder = "listing"
+    bandwidthLimit: float | None = Field(default=None, gt=0)  # MB/s, where 1 MB is 1000 * 1000 bytes
 
 
 class LogEntry(BaseModel):
@@ -22,3 +26,13 @@ class LogEntry(BaseModel):
 class BackupYield(BaseModel):
     progress: float | None = None
     log: LogEntry | None = None
+
+
+class BackupPlanSummary(BaseModel):
+    totalFiles: int
+    totalBytes: int
+    newFiles: int
+    newBytes: int
+    skippedFiles: int
+    skippedBytes: int
+    projectedSeconds: float
@@ -0,0 +1,56 @@
+"""Benchmark `DevicePath.copy` against ppadb's `pull` on a large file.
+
+The fake ADB server from the backend tests streams the file from memory, so the numbers compare host side overhead
+only and are likely limited by the fake server itself. Use a real device for absolute throughput.
+
+Usage:
+    python scripts/bench-pull.py [--size-mib 1024] [--rounds 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent / "backend"
+sys.path[:0] = [str(BACKEND), str(BACKEND / "tests")]
+
+from adb import Device, DevicePath  # noqa: E402
+from fake_adb import CHUNK_SIZE, FakeAdbServer  # noqa: E402
+from ppadb.client import Client as AdbClient  # noqa: E402
+from ppadb.device import Device as AdbDevice  # noqa: E402
+
+SRC = "/sdcard/DCIM/big.mp4"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mib", type=int, default=1024, help="File size in MiB")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    size = args.size_mib * 1024 * 1024
+    server = FakeAdbServer(files={SRC: os.urandom(CHUNK_SIZE) * (size // CHUNK_SIZE)}).start()
+    adb_device = AdbDevice(AdbClient(port=server.port), "abc")
+    path = DevicePath(Device(adb_device, "device"), SRC, False, size, 0)
+
+    try:
+        with tempfile.TemporaryDirectory(dir=".") as tmp:
+            for i in range(args.rounds):
+                start = time.perf_counter()
+                adb_device.pull(SRC, str(Path(tmp, "ppadb")))
+                ppadb_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                path.copy(Path(tmp, "backphoto"))
+                ours_time = time.perf_counter() - start
+
+                print(f"Round {i + 1}: ppadb pull {size / ppadb_time / 2**20:.0f} MiB/s, DevicePath.copy {size / ours_time / 2**20:.0f} MiB/s")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ export interface UserConfig {
 	skipDot: boolean;
 	moveFiles: boolean;
 	removeTempFiles: boolean;
+	transferOrder: "listing" | "smallFirst" | "newestFirst" | "cameraFirst";
+	bandwidthLimit?: number; // MB/s, where 1 MB is 1000 * 1000 bytes
 }
 const DEFAULT_USER_CONFIG: UserConfig = {
 	destinationPath: "",
@@ -19,6 +21,7 @@ const DEFAULT_USER_CONFIG: UserConfig = {
 	skipDot: true,
 	moveFiles: true,
 	removeTempFiles: true,
+	transferOrder: "listing",
 };
 
 const store = new Store<UserConfig>({